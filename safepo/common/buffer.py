@@ -50,33 +50,32 @@ class VectorizedOnPolicyBuffer:
         device: torch.device = "cpu",
         num_envs: int = 1,
     ) -> None:
-        self.buffers: list[dict[str, torch.tensor]] = [
-            {
-                "obs": torch.zeros(
-                    (size, *obs_space.shape), dtype=torch.float32, device=device
-                ),
-                "act": torch.zeros(
-                    (size, *act_space.shape), dtype=torch.float32, device=device
-                ),
-                "reward": torch.zeros(size, dtype=torch.float32, device=device),
-                "cost": torch.zeros(size, dtype=torch.float32, device=device),
-                "done": torch.zeros(size, dtype=torch.float32, device=device),
-                "value_r": torch.zeros(size, dtype=torch.float32, device=device),
-                "value_c": torch.zeros(size, dtype=torch.float32, device=device),
-                "adv_r": torch.zeros(size, dtype=torch.float32, device=device),
-                "adv_c": torch.zeros(size, dtype=torch.float32, device=device),
-                "target_value_r": torch.zeros(size, dtype=torch.float32, device=device),
-                "target_value_c": torch.zeros(size, dtype=torch.float32, device=device),
-                "log_prob": torch.zeros(size, dtype=torch.float32, device=device),
-            }
-            for _ in range(num_envs)
-        ]
+        # Every field is stored as a single ``(num_envs, size, ...)`` tensor, so a
+        # step is written with one copy per field and ``get`` is a reshape.
+        self.buffers: dict[str, torch.Tensor] = {
+            "obs": torch.zeros(
+                (num_envs, size, *obs_space.shape), dtype=torch.float32, device=device
+            ),
+            "act": torch.zeros(
+                (num_envs, size, *act_space.shape), dtype=torch.float32, device=device
+            ),
+            "reward": torch.zeros((num_envs, size), dtype=torch.float32, device=device),
+            "cost": torch.zeros((num_envs, size), dtype=torch.float32, device=device),
+            "done": torch.zeros((num_envs, size), dtype=torch.float32, device=device),
+            "value_r": torch.zeros((num_envs, size), dtype=torch.float32, device=device),
+            "value_c": torch.zeros((num_envs, size), dtype=torch.float32, device=device),
+            "adv_r": torch.zeros((num_envs, size), dtype=torch.float32, device=device),
+            "adv_c": torch.zeros((num_envs, size), dtype=torch.float32, device=device),
+            "target_value_r": torch.zeros((num_envs, size), dtype=torch.float32, device=device),
+            "target_value_c": torch.zeros((num_envs, size), dtype=torch.float32, device=device),
+            "log_prob": torch.zeros((num_envs, size), dtype=torch.float32, device=device),
+        }
         self._gamma = gamma
         self._lam = lam
         self._lam_c = lam_c
         self._standardized_adv_r = standardized_adv_r
         self._standardized_adv_c = standardized_adv_c
-        self.ptr_list = [0] * num_envs
+        self.ptr = 0
         self.path_start_idx_list = [0] * num_envs
         self._device = device
         self.num_envs = num_envs
@@ -88,11 +87,11 @@ class VectorizedOnPolicyBuffer:
         Args:
             **data: Keyword arguments specifying data tensors to be stored.
         """
-        for i, buffer in enumerate(self.buffers):
-            assert self.ptr_list[i] < buffer["obs"].shape[0], "Buffer overflow"
-            for key, value in data.items():
-                buffer[key][self.ptr_list[i]] = value[i]
-            self.ptr_list[i] += 1
+        assert self.ptr < self.buffers["obs"].shape[1], "Buffer overflow"
+        for key, value in data.items():
+            buffer = self.buffers[key]
+            buffer[:, self.ptr] = value.reshape(self.num_envs, *buffer.shape[2:])
+        self.ptr += 1
 
     def finish_path(
         self,
@@ -112,13 +111,13 @@ class VectorizedOnPolicyBuffer:
             last_value_r = torch.zeros(1, device=self._device)
         if last_value_c is None:
             last_value_c = torch.zeros(1, device=self._device)
-        path_slice = slice(self.path_start_idx_list[idx], self.ptr_list[idx])
+        path_slice = slice(self.path_start_idx_list[idx], self.ptr)
         last_value_r = last_value_r.to(self._device)
         last_value_c = last_value_c.to(self._device)
-        rewards = torch.cat([self.buffers[idx]["reward"][path_slice], last_value_r])
-        costs = torch.cat([self.buffers[idx]["cost"][path_slice], last_value_c])
-        values_r = torch.cat([self.buffers[idx]["value_r"][path_slice], last_value_r])
-        values_c = torch.cat([self.buffers[idx]["value_c"][path_slice], last_value_c])
+        rewards = torch.cat([self.buffers["reward"][idx, path_slice], last_value_r])
+        costs = torch.cat([self.buffers["cost"][idx, path_slice], last_value_c])
+        values_r = torch.cat([self.buffers["value_r"][idx, path_slice], last_value_r])
+        values_c = torch.cat([self.buffers["value_c"][idx, path_slice], last_value_c])
 
         adv_r, target_value_r = calculate_adv_and_value_targets(
             values_r,
@@ -132,25 +131,24 @@ class VectorizedOnPolicyBuffer:
             lam=self._lam_c,
             gamma=self._gamma,
         )
-        self.buffers[idx]["adv_r"][path_slice] = adv_r
-        self.buffers[idx]["adv_c"][path_slice] = adv_c
-        self.buffers[idx]["target_value_r"][path_slice] = target_value_r
-        self.buffers[idx]["target_value_c"][path_slice] = target_value_c
+        self.buffers["adv_r"][idx, path_slice] = adv_r
+        self.buffers["adv_c"][idx, path_slice] = adv_c
+        self.buffers["target_value_r"][idx, path_slice] = target_value_r
+        self.buffers["target_value_c"][idx, path_slice] = target_value_c
 
-        self.path_start_idx_list[idx] = self.ptr_list[idx]
+        self.path_start_idx_list[idx] = self.ptr
 
     def get(self) -> dict[str, torch.Tensor]:
         """
         Retrieve collected data from the buffer.
 
+        The returned tensors are views of the buffer, ordered environment by
+        environment, and are overwritten by the next rollout.
+
         Returns:
             dict[str, torch.Tensor]: A dictionary containing collected data tensors.
         """
-        data_pre = {k: [v] for k, v in self.buffers[0].items()}
-        for buffer in self.buffers[1:]:
-            for k, v in buffer.items():
-                data_pre[k].append(v)
-        data = {k: torch.cat(v, dim=0) for k, v in data_pre.items()}
+        data = {k: v.reshape(-1, *v.shape[2:]) for k, v in self.buffers.items()}
         adv_mean = data["adv_r"].mean()
         adv_std = data["adv_r"].std()
         cadv_mean = data["adv_c"].mean()
@@ -158,7 +156,7 @@ class VectorizedOnPolicyBuffer:
             data["adv_r"] = (data["adv_r"] - adv_mean) / (adv_std + 1e-8)
         if self._standardized_adv_c:
             data["adv_c"] = data["adv_c"] - cadv_mean
-        self.ptr_list = [0] * self.num_envs
+        self.ptr = 0
         self.path_start_idx_list = [0] * self.num_envs
 
         return data
@@ -369,19 +367,23 @@ class SeparatedReplayBuffer(object):
             None
         """
         self.value_preds[-1] = next_value
-        gae = 0
-        for step in reversed(range(self.rewards.shape[0])):
-            delta = self.rewards[step] + self.gamma * value_normalizer.denormalize(self.value_preds[step + 1]) * self.masks[step + 1] - value_normalizer.denormalize(self.value_preds[step])
-            gae = delta + self.gamma * self.gae_lambda * self.masks[step + 1] * gae
-            self.returns[step] = gae + value_normalizer.denormalize(self.value_preds[step])
+        self._compute_gae(self.rewards, self.value_preds, self.returns, value_normalizer)
 
     def compute_cost_returns(self, next_cost, value_normalizer=None):
         self.cost_preds[-1] = next_cost
-        gae = 0
-        for step in reversed(range(self.costs.shape[0])):
-            delta = self.costs[step] + self.gamma * value_normalizer.denormalize(self.cost_preds[step + 1]) * self.masks[step + 1] - value_normalizer.denormalize(self.cost_preds[step])
-            gae = delta + self.gamma * self.gae_lambda * self.masks[step + 1] * gae
-            self.cost_returns[step] = gae + value_normalizer.denormalize(self.cost_preds[step])
+        self._compute_gae(self.costs, self.cost_preds, self.cost_returns, value_normalizer)
+
+    def _compute_gae(self, rewards, preds, returns, value_normalizer):
+        # Denormalization and the TD residuals are computed for the whole
+        # rollout at once; only the recursion over time stays in Python.
+        values = value_normalizer.denormalize(preds)
+        deltas = rewards + self.gamma * values[1:] * self.masks[1:] - values[:-1]
+        discounts = self.gamma * self.gae_lambda * self.masks[1:]
+        gae = torch.zeros_like(deltas[0])
+        for step in reversed(range(rewards.shape[0])):
+            gae = deltas[step] + discounts[step] * gae
+            returns[step] = gae
+        returns[:-1] += values[:-1]
 
     def feed_forward_generator(self, advantages, num_mini_batch=None, mini_batch_size=None, cost_adv=None):        
         episode_length, n_rollout_threads = self.rewards.shape[0:2]
@@ -397,34 +399,37 @@ class SeparatedReplayBuffer(object):
                           num_mini_batch))
             mini_batch_size = batch_size // num_mini_batch
 
-        rand = torch.randperm(batch_size)
-        sampler = [rand[i*mini_batch_size:(i+1)*mini_batch_size] for i in range(num_mini_batch)]
+        rand = torch.randperm(batch_size, device=self.device)
 
-        share_obs = self.share_obs[:-1].reshape(-1, *self.share_obs.shape[2:])
-        obs = self.obs[:-1].reshape(-1, *self.obs.shape[2:])
-        rnn_states = self.rnn_states[:-1].reshape(-1, *self.rnn_states.shape[2:])
-        rnn_states_critic = self.rnn_states_critic[:-1].reshape(-1, *self.rnn_states_critic.shape[2:])
-        rnn_states_cost = self.rnn_states_cost[:-1].reshape(-1, *self.rnn_states_cost.shape[2:])
+        # Shuffle every flattened tensor once so that each mini batch below is a
+        # contiguous slice instead of a scattered gather.
+        share_obs = self.share_obs[:-1].reshape(-1, *self.share_obs.shape[2:])[rand]
+        obs = self.obs[:-1].reshape(-1, *self.obs.shape[2:])[rand]
+        rnn_states = self.rnn_states[:-1].reshape(-1, *self.rnn_states.shape[2:])[rand]
+        rnn_states_critic = self.rnn_states_critic[:-1].reshape(-1, *self.rnn_states_critic.shape[2:])[rand]
+        rnn_states_cost = self.rnn_states_cost[:-1].reshape(-1, *self.rnn_states_cost.shape[2:])[rand]
 
-        actions = self.actions.reshape(-1, self.actions.shape[-1])
+        actions = self.actions.reshape(-1, self.actions.shape[-1])[rand]
         if self.available_actions is not None:
-            available_actions = self.available_actions[:-1].reshape(-1, self.available_actions.shape[-1])
-        value_preds = self.value_preds[:-1].reshape(-1, 1)
-        returns = self.returns[:-1].reshape(-1, 1)
-        cost_preds = self.cost_preds[:-1].reshape(-1, 1)
-        cost_returns = self.cost_returns[:-1].reshape(-1, 1)
-        masks = self.masks[:-1].reshape(-1, 1)
-        active_masks = self.active_masks[:-1].reshape(-1, 1)
-        action_log_probs = self.action_log_probs.reshape(-1, self.action_log_probs.shape[-1])
+            available_actions = self.available_actions[:-1].reshape(-1, self.available_actions.shape[-1])[rand]
+        value_preds = self.value_preds[:-1].reshape(-1, 1)[rand]
+        returns = self.returns[:-1].reshape(-1, 1)[rand]
+        cost_preds = self.cost_preds[:-1].reshape(-1, 1)[rand]
+        cost_returns = self.cost_returns[:-1].reshape(-1, 1)[rand]
+        masks = self.masks[:-1].reshape(-1, 1)[rand]
+        active_masks = self.active_masks[:-1].reshape(-1, 1)[rand]
+        action_log_probs = self.action_log_probs.reshape(-1, self.action_log_probs.shape[-1])[rand]
         aver_episode_costs = self.aver_episode_costs
 
         if self.factor is not None:
-            factor = self.factor.reshape(-1, self.factor.shape[-1])
-        advantages = advantages.reshape(-1, 1)
+            factor = self.factor.reshape(-1, self.factor.shape[-1])[rand]
+        if advantages is not None:
+            advantages = advantages.reshape(-1, 1)[rand]
         if cost_adv is not None:
-            cost_adv = cost_adv.reshape(-1, 1)
+            cost_adv = cost_adv.reshape(-1, 1)[rand]
 
-        for indices in sampler:
+        for i in range(num_mini_batch):
+            indices = slice(i * mini_batch_size, (i + 1) * mini_batch_size)
             share_obs_batch = share_obs[indices]
             obs_batch = obs[indices]
             rnn_states_batch = rnn_states[indices]
@@ -128,6 +128,8 @@ def make_ma_mujoco_env(scenario, agent_conf, seed, cfg_train):
     Returns:
         env: A multi-agent environment.
     """
+    running_obs_norm = cfg_train.get("running_obs_norm", False)
+
     def get_env_fn(rank):
         def init_env():
             """
@@ -139,6 +141,7 @@ def make_ma_mujoco_env(scenario, agent_conf, seed, cfg_train):
             env=ShareEnv(
                 scenario=scenario,
                 agent_conf=agent_conf,
+                normalize_obs=not running_obs_norm,
             )
             env.reset(seed=seed + rank * 1000)
             return env
@@ -146,9 +149,11 @@ def make_ma_mujoco_env(scenario, agent_conf, seed, cfg_train):
         return init_env
 
     if cfg_train['n_rollout_threads']== 1:
-        return ShareDummyVecEnv([get_env_fn(0)], cfg_train['device'])
+        return ShareDummyVecEnv([get_env_fn(0)], cfg_train['device'], running_obs_norm=running_obs_norm)
     else:
-        return ShareSubprocVecEnv([get_env_fn(i) for i in range(cfg_train['n_rollout_threads'])])
+        return ShareSubprocVecEnv(
+            [get_env_fn(i) for i in range(cfg_train['n_rollout_threads'])], running_obs_norm=running_obs_norm
+        )
 
 def make_ma_multi_goal_env(task, seed,num_agents, cfg_train):
     """
@@ -161,6 +166,8 @@ def make_ma_multi_goal_env(task, seed,num_agents, cfg_train):
     Returns:
         env: A multi-agent environment.
     """
+    running_obs_norm = cfg_train.get("running_obs_norm", False)
+
     def get_env_fn(rank):
         def init_env():
             """
@@ -173,15 +180,18 @@ def make_ma_multi_goal_env(task, seed,num_agents, cfg_train):
                 task=task,
                 seed=seed,
                 num_agents=num_agents,
+                normalize_obs=not running_obs_norm,
             )
             return env
 
         return init_env
     
     if cfg_train['n_rollout_threads']== 1:
-        return ShareDummyVecEnv([get_env_fn(0)], cfg_train['device'])
+        return ShareDummyVecEnv([get_env_fn(0)], cfg_train['device'], running_obs_norm=running_obs_norm)
     else:
-        return ShareSubprocVecEnv([get_env_fn(i) for i in range(cfg_train['n_rollout_threads'])])
+        return ShareSubprocVecEnv(
+            [get_env_fn(i) for i in range(cfg_train['n_rollout_threads'])], running_obs_norm=running_obs_norm
+        )
 
 def make_ma_isaac_env(args, cfg, cfg_train, sim_params, agent_index):
     """
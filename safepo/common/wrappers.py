@@ -16,15 +16,21 @@
 
 from __future__ import annotations
 
+import math
+import os
+import pickle
+import sys
+import weakref
 from abc import ABC, abstractmethod
-from multiprocessing import Pipe, Process
+import multiprocessing
+from multiprocessing import resource_tracker, shared_memory
 
 from typing import Any
 import torch
 import numpy as np
 from gymnasium.vector.vector_env import VectorEnv
 from gymnasium.spaces import Box
-from gymnasium.wrappers.normalize import NormalizeObservation
+from gymnasium.wrappers.normalize import NormalizeObservation, RunningMeanStd
 
 import safety_gymnasium
 from safety_gymnasium.vector.utils.tile_images import tile_images
@@ -38,6 +44,34 @@ try :
     from safety_gymnasium.tasks.safe_isaac_gym.envs.tasks.base.vec_task import VecTaskPython as FrankaVecTaskPython
 except ImportError:
     pass
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
+
+if njit is not None:
+    @njit(cache=True, error_model="numpy")
+    def normalize_rows(obs):
+        """Standardizes every row of ``obs`` in one fused pass per row."""
+        out = np.empty_like(obs)
+        n_rows, n_cols = obs.shape
+        for i in range(n_rows):
+            mean = 0.0
+            for j in range(n_cols):
+                mean += obs[i, j]
+            mean /= n_cols
+            var = 0.0
+            for j in range(n_cols):
+                var += (obs[i, j] - mean) ** 2
+            std = math.sqrt(var / n_cols)
+            for j in range(n_cols):
+                out[i, j] = (obs[i, j] - mean) / std
+        return out
+else:
+    def normalize_rows(obs):
+        """Standardizes every row of ``obs`` by its own mean and standard deviation."""
+        return (obs - obs.mean(axis=1, keepdims=True)) / obs.std(axis=1, keepdims=True)
 
 class SafeNormalizeObservation(NormalizeObservation):
     """This wrapper will normalize observations as Gymnasium's NormalizeObservation wrapper does."""
@@ -72,8 +106,11 @@ class MultiGoalEnv():
         task,
         seed,
         num_agents,
+        normalize_obs: bool = True,
     ):
         self.num_agents = num_agents
+        # with running observation normalization the vec env normalizes the raw rows
+        self.normalize_obs = normalize_obs
 
         self.env = safety_gymnasium.make(task, agent_num=self.num_agents)
         self.single_action_space = self.env.action_space['agent_0']
@@ -82,14 +119,23 @@ class MultiGoalEnv():
             self.action_spaces['agent_' + str(i)] = self.env.action_space['agent_' + str(i)]
         self.env.reset(seed=seed)
         self.n_actions = self.single_action_space.shape[0]
-        self.share_obs_size = self._get_share_obs_size()
-        self.obs_size=self._get_obs_size()
+        self._possible_agents = tuple(self.possible_agents)
+        # every action is always available, so one read-only array is shared by all steps
+        self._avail_actions = np.ones((self.num_agents, self.n_actions), dtype=np.float32)
+        self._avail_actions.setflags(write=False)
+        # per-agent observations share one buffer whose trailing one-hot
+        # agent id block is constant and filled once
+        agent_state_size = self.env.task.obs()['agent_0'].shape[0]
+        self._obs_buf = np.zeros((self.num_agents, agent_state_size + self.num_agents), dtype=np.float32)
+        self._obs_buf[:, agent_state_size:] = np.eye(self.num_agents, dtype=np.float32)
+        self.share_obs_size = agent_state_size * self.num_agents
+        self.obs_size = agent_state_size + self.num_agents
         print("share_obs_size", self.share_obs_size, self.obs_size)
         self.share_observation_spaces = {}
         self.observation_spaces = {}
         for agent in range(self.num_agents):
-            self.share_observation_spaces[f"agent_{agent}"] = Box(low=-10, high=10, shape=(self.share_obs_size,)) 
-            self.observation_spaces[f"agent_{agent}"] = Box(low=-10, high=10, shape=(self.obs_size,)) 
+            self.share_observation_spaces[f"agent_{agent}"] = Box(low=-10, high=10, shape=(self.share_obs_size,), dtype=np.float32)
+            self.observation_spaces[f"agent_{agent}"] = Box(low=-10, high=10, shape=(self.obs_size,), dtype=np.float32)
 
     def __getattr__(self, name: str) -> Any:
         """Returns an attribute with ``name``, unless ``name`` starts with an underscore."""
@@ -97,44 +143,34 @@ class MultiGoalEnv():
             raise AttributeError(f"accessing private attribute '{name}' is prohibited")
         return getattr(self.env, name)
 
-    def _get_obs(self):
+    def _get_observations(self):
+        """Builds the per-agent and shared observations from a single ``task.obs()`` call."""
         state = self.env.task.obs()
-        obs_n = []
-        for a in range(self.num_agents):
-            agent_id_feats = np.zeros(self.num_agents, dtype=np.float32)
-            agent_id_feats[a] = 1.0
-            obs_i = np.concatenate([state['agent_'+str(a)], agent_id_feats])
-            obs_i = (obs_i - np.mean(obs_i)) / np.std(obs_i)
-            obs_n.append(obs_i)
-        return obs_n
+        obs = self._obs_buf
+        obs[:, :-self.num_agents] = [state['agent_'+str(a)] for a in range(self.num_agents)]
+        share_state = obs[:, :-self.num_agents].reshape(-1)
+        state_normed = (share_state - np.mean(share_state)) / (np.std(share_state)+1e-8)
+        share_obs = np.broadcast_to(state_normed, (self.num_agents, state_normed.size))
+        return normalize_rows(obs) if self.normalize_obs else obs.copy(), share_obs
+
+    def _get_obs(self):
+        return self._get_observations()[0]
 
     def _get_obs_size(self):
-        return len(self._get_obs()[0])
+        return self.obs_size
 
     def _get_share_obs(self):
-        state = self.env.task.obs()#['agent_0']
-        share_state = np.concatenate([state['agent_'+str(i)] for i in range(self.num_agents)])
-        state = share_state
-        state_normed = (state - np.mean(state)) / (np.std(state)+1e-8)
-        share_obs = []
-        for _ in range(self.num_agents):
-            share_obs.append(state_normed)
-        return share_obs
+        return self._get_observations()[1]
 
     def _get_share_obs_size(self):
-        return len(self._get_share_obs()[0])
+        return self.share_obs_size
 
     def _get_avail_actions(self):
-        return np.ones(
-            shape=(
-                self.num_agents,
-                self.n_actions,
-            )
-        )
+        return self._avail_actions
 
     def reset(self, seed=None):
         self.env.reset(seed=seed)
-        return self._get_obs(), self._get_share_obs(), self._get_avail_actions()
+        return *self._get_observations(), self._get_avail_actions()
 
     
     def step(
@@ -146,17 +182,23 @@ class MultiGoalEnv():
         dict[str, np.ndarray],
         dict[str, str],
     ]:
-        dict_actions={}
-        for agent_id, agent in enumerate(self.possible_agents):
-            dict_actions[agent]=actions[agent_id].cpu().numpy()
+        actions = actions.cpu().numpy() if isinstance(actions, torch.Tensor) else np.asarray(actions)
+        dict_actions = dict(zip(self._possible_agents, actions))
         _, rewards, costs, terminations, truncations, infos = self.env.step(dict_actions)
-        dones={}
-        for agent_id, agent in enumerate(self.possible_agents):
-            dones[agent] = terminations[agent] or truncations[agent]
-            rewards[agent] = [rewards[agent]]
-            costs[agent]=[costs[agent]]
-        rewards, costs, dones, infos = list(rewards.values()), list(costs.values()), list(dones.values()), list(infos.values())
-        return self._get_obs(), self._get_share_obs(), rewards, costs, dones, infos, self._get_avail_actions()
+        rewards = np.fromiter(
+            (rewards[agent] for agent in self._possible_agents), dtype=np.float32, count=self.num_agents
+        ).reshape(-1, 1)
+        costs = np.fromiter(
+            (costs[agent] for agent in self._possible_agents), dtype=np.float32, count=self.num_agents
+        ).reshape(-1, 1)
+        dones = np.fromiter(
+            (terminations[agent] or truncations[agent] for agent in self._possible_agents),
+            dtype=np.bool_,
+            count=self.num_agents,
+        )
+        infos = [infos[agent] for agent in self._possible_agents]
+        obs, share_obs = self._get_observations()
+        return obs, share_obs, rewards, costs, dones, infos, self._get_avail_actions()
 
 
 class ShareEnv(SafeMAEnv):
@@ -170,6 +212,7 @@ class ShareEnv(SafeMAEnv):
         local_categories: list[list[str]] | None = None,
         global_categories: tuple[str, ...] | None = None,
         render_mode: str | None = None,
+        normalize_obs: bool = True,
         **kwargs,
     ):
         super().__init__(
@@ -184,50 +227,53 @@ class ShareEnv(SafeMAEnv):
         )
         self.num_agents = len(self.agent_action_partitions)
         self.n_actions = max([len(l) for l in self.agent_action_partitions])
-        self.share_obs_size = self._get_share_obs_size()
-        self.obs_size=self._get_obs_size()
+        self._possible_agents = tuple(self.possible_agents)
+        # every action is always available, so one read-only array is shared by all steps
+        self._avail_actions = np.ones((self.num_agents, self.n_actions), dtype=np.float32)
+        self._avail_actions.setflags(write=False)
+        # per-agent observations share one buffer whose trailing one-hot
+        # agent id block is constant and filled once
+        state_size = self.env.state().shape[0]
+        # with running observation normalization the vec env normalizes the raw rows
+        self.normalize_obs = normalize_obs
+        self._obs_buf = np.zeros((self.num_agents, state_size + self.num_agents), dtype=np.float32)
+        self._obs_buf[:, state_size:] = np.eye(self.num_agents, dtype=np.float32)
+        self.share_obs_size = state_size
+        self.obs_size = state_size + self.num_agents
         self.share_observation_spaces = {}
         self.observation_spaces={}
         for agent in range(self.num_agents):
-            self.share_observation_spaces[f"agent_{agent}"] = Box(low=-10, high=10, shape=(self.share_obs_size,)) 
-            self.observation_spaces[f"agent_{agent}"] = Box(low=-10, high=10, shape=(self.obs_size,)) 
+            self.share_observation_spaces[f"agent_{agent}"] = Box(low=-10, high=10, shape=(self.share_obs_size,), dtype=np.float32)
+            self.observation_spaces[f"agent_{agent}"] = Box(low=-10, high=10, shape=(self.obs_size,), dtype=np.float32)
+
+    def _get_observations(self):
+        """Builds the per-agent and shared observations from a single ``state()`` call."""
+        # cast once at the boundary so the whole observation path stays float32
+        state = np.asarray(self.env.state(), dtype=np.float32)
+        obs = self._obs_buf
+        obs[:, :-self.num_agents] = state
+        state_normed = (state - np.mean(state)) / (np.std(state)+1e-8)
+        share_obs = np.broadcast_to(state_normed, (self.num_agents, state_normed.size))
+        return normalize_rows(obs) if self.normalize_obs else obs.copy(), share_obs
 
     def _get_obs(self):
-        state = self.env.state()
-        obs_n = []
-        for a in range(self.num_agents):
-            agent_id_feats = np.zeros(self.num_agents, dtype=np.float32)
-            agent_id_feats[a] = 1.0
-            obs_i = np.concatenate([state, agent_id_feats])
-            obs_i = (obs_i - np.mean(obs_i)) / np.std(obs_i)
-            obs_n.append(obs_i)
-        return obs_n
+        return self._get_observations()[0]
 
     def _get_obs_size(self):
-        return len(self._get_obs()[0])
+        return self.obs_size
 
     def _get_share_obs(self):
-        state = self.env.state()
-        state_normed = (state - np.mean(state)) / (np.std(state)+1e-8)
-        share_obs = []
-        for _ in range(self.num_agents):
-            share_obs.append(state_normed)
-        return share_obs
+        return self._get_observations()[1]
 
     def _get_share_obs_size(self):
-        return len(self._get_share_obs()[0])
+        return self.share_obs_size
 
     def _get_avail_actions(self):
-        return np.ones(
-            shape=(
-                self.num_agents,
-                self.n_actions,
-            )
-        )
+        return self._avail_actions
 
     def reset(self, seed=None):
         super().reset(seed=seed)
-        return self._get_obs(), self._get_share_obs(), self._get_avail_actions()
+        return *self._get_observations(), self._get_avail_actions()
 
     
     def step(
@@ -239,17 +285,23 @@ class ShareEnv(SafeMAEnv):
         dict[str, np.ndarray],
         dict[str, str],
     ]:
-        dict_actions={}
-        for agent_id, agent in enumerate(self.possible_agents):
-            dict_actions[agent]=actions[agent_id].cpu().numpy()
+        actions = actions.cpu().numpy() if isinstance(actions, torch.Tensor) else np.asarray(actions)
+        dict_actions = dict(zip(self._possible_agents, actions))
         _, rewards, costs, terminations, truncations, infos = super().step(dict_actions)
-        dones={}
-        for agent_id, agent in enumerate(self.possible_agents):
-            dones[agent] = terminations[agent] or truncations[agent]
-            rewards[agent] = [rewards[agent]]
-            costs[agent]=[costs[agent]]
-        rewards, costs, dones, infos = list(rewards.values()), list(costs.values()), list(dones.values()), list(infos.values())
-        return self._get_obs(), self._get_share_obs(), rewards, costs, dones, infos, self._get_avail_actions()
+        rewards = np.fromiter(
+            (rewards[agent] for agent in self._possible_agents), dtype=np.float32, count=self.num_agents
+        ).reshape(-1, 1)
+        costs = np.fromiter(
+            (costs[agent] for agent in self._possible_agents), dtype=np.float32, count=self.num_agents
+        ).reshape(-1, 1)
+        dones = np.fromiter(
+            (terminations[agent] or truncations[agent] for agent in self._possible_agents),
+            dtype=np.bool_,
+            count=self.num_agents,
+        )
+        infos = [infos[agent] for agent in self._possible_agents]
+        obs, share_obs = self._get_observations()
+        return obs, share_obs, rewards, costs, dones, infos, self._get_avail_actions()
 
 
 class CloudpickleWrapper:
@@ -272,6 +324,8 @@ class ShareVecEnv(ABC):
 
     closed = False
     viewer = None
+    obs_rms = None
+    update_obs_rms = True
 
     metadata = {'render.modes': ['human', 'rgb_array']}
 
@@ -335,6 +389,9 @@ class ShareVecEnv(ABC):
          - cos: an array of costs
          - dones: an array of "episode done" booleans
          - infos: a sequence of info objects
+
+        The returned arrays are reused by the next step or reset, so callers
+        that keep them across steps must copy them.
         """
         pass
 
@@ -379,6 +436,70 @@ class ShareVecEnv(ABC):
         """
         raise NotImplementedError
 
+    def _result_layout(self):
+        """Per-environment shapes and dtypes of the batched step results."""
+        n_actions = max(space.shape[0] for space in self._action_space.values())
+        return {
+            'obs': ((self.num_agents, self._observation_space['agent_0'].shape[0]), np.float32),
+            # every agent shares the same global state, so only one row is kept
+            'share_obs': ((self._share_observation_space['agent_0'].shape[0],), np.float32),
+            'rews': ((self.num_agents, 1), np.float32),
+            'costs': ((self.num_agents, 1), np.float32),
+            'dones': ((self.num_agents,), np.bool_),
+            'available_actions': ((self.num_agents, n_actions), np.float32),
+        }
+
+    def _allocate_result_tensors(self):
+        # on CPU the output tensors are zero-copy views of the per-field result
+        # buffers, elsewhere they are persistent device tensors refreshed in place
+        self.results_aliased = torch.device(self.device).type == 'cpu'
+        if self.results_aliased:
+            self.result_tensors = {key: torch.from_numpy(buffer) for key, buffer in self.result_buffers.items()}
+        else:
+            self.result_tensors = {
+                key: torch.from_numpy(buffer).to(self.device, copy=True)
+                for key, buffer in self.result_buffers.items()
+            }
+
+    def _init_obs_rms(self, running_obs_norm):
+        if running_obs_norm:
+            self.obs_rms = RunningMeanStd(shape=self._observation_space['agent_0'].shape)
+
+    def _normalize_obs_results(self):
+        """Normalizes the raw observations in the result buffer in place by the running statistics."""
+        if self.obs_rms is None:
+            return
+        obs = self.result_buffers['obs']
+        if self.update_obs_rms:
+            self.obs_rms.update(obs.reshape(-1, obs.shape[-1]))
+        obs -= self.obs_rms.mean
+        obs /= np.sqrt(self.obs_rms.var + 1e-8)
+
+    def obs_rms_state_dict(self):
+        """Running observation statistics as tensors, to be saved beside the actor checkpoints."""
+        return {
+            'mean': torch.as_tensor(self.obs_rms.mean),
+            'var': torch.as_tensor(self.obs_rms.var),
+            'count': torch.as_tensor(self.obs_rms.count),
+        }
+
+    def load_obs_rms_state_dict(self, state_dict):
+        self.obs_rms.mean = state_dict['mean'].cpu().numpy()
+        self.obs_rms.var = state_dict['var'].cpu().numpy()
+        self.obs_rms.count = state_dict['count'].item()
+
+    def freeze_obs_rms(self, source=None):
+        """Stops updating the running statistics, after taking them over from ``source`` if given."""
+        if source is not None and source is not self:
+            self.load_obs_rms_state_dict(source.obs_rms_state_dict())
+        self.update_obs_rms = False
+
+    def _read_results(self, *keys):
+        # the returned tensors are only valid until the next step or reset
+        if self.results_aliased:
+            return [self.result_tensors[key] for key in keys]
+        return [self.result_tensors[key].copy_(torch.from_numpy(self.result_buffers[key])) for key in keys]
+
     @property
     def unwrapped(self):
         if isinstance(self, VectorEnv):
@@ -395,100 +516,225 @@ class ShareVecEnv(ABC):
 
 
 
+# Worker commands travel as a one-byte opcode, followed by a pickled payload
+# only for the commands that carry data.
+(
+    CMD_STEP,
+    CMD_RESET,
+    CMD_RESET_TASK,
+    CMD_RENDER,
+    CMD_CLOSE,
+    CMD_GET_SPACES,
+    CMD_RENDER_VULNERABILITY,
+    CMD_GET_NUM_AGENTS,
+    CMD_ATTACH_SHARED_MEMORY,
+) = range(9)
+
+
+def send_command(remote, cmd, data=None):
+    payload = b'' if data is None else pickle.dumps(data, protocol=pickle.HIGHEST_PROTOCOL)
+    remote.send_bytes(bytes((cmd,)) + payload)
+
+
+def recv_command(remote):
+    message = remote.recv_bytes()
+    return message[0], pickle.loads(message[1:]) if len(message) > 1 else None
+
+
+def release_shared_memories(shared_memories):
+    """Closes and unlinks the shared memory segments created by a vec env."""
+    for shm in shared_memories:
+        try:
+            shm.close()
+        except BufferError:
+            # step results still held by the caller keep the mapping alive
+            # until they are released, the segment itself is unlinked below
+            pass
+        try:
+            shm.unlink()
+        except FileNotFoundError:
+            pass
+
+
 def shareworker(remote, parent_remote, env_fn_wrapper):
     parent_remote.close()
-    env = env_fn_wrapper.x()
+    envs = [env_fn() for env_fn in env_fn_wrapper.x]
+    # step and reset results are written into this worker's slots of the
+    # shared-memory buffers, only the infos still travel through the pipe
+    shared_memories = []
+    shared = {}
+
+    def write_shared(i, ob, s_ob, available_actions, reward=None, cost=None, done=None):
+        shared['obs'][i] = ob
+        # every agent shares the same global state, so only one row is kept
+        shared['share_obs'][i] = s_ob[0]
+        shared['available_actions'][i] = available_actions
+        if done is not None:
+            shared['rews'][i] = reward
+            shared['costs'][i] = cost
+            shared['dones'][i] = done
+
     while True:
-        cmd, data = remote.recv()
-        if cmd == 'step':
-            ob, s_ob, reward, cost, done, info, available_actions = env.step(data)
-            if 'bool' in done.__class__.__name__:
-                if done:
-                    ob, s_ob, available_actions = env.reset()
-            else:
-                if np.all(done):
-                    ob, s_ob, available_actions = env.reset()
-
-            remote.send((ob, s_ob, reward, cost, done, info, available_actions))
-        elif cmd == 'reset':
-            ob, s_ob, available_actions = env.reset()
-            remote.send((ob, s_ob, available_actions))
-        elif cmd == 'reset_task':
-            ob = env.reset_task()
-            remote.send(ob)
-        elif cmd == 'render':
+        cmd, data = recv_command(remote)
+        if cmd == CMD_STEP:
+            infos = []
+            # the actions of this worker's environments are read from shared memory
+            for i, (env, action) in enumerate(zip(envs, shared['actions'])):
+                ob, s_ob, reward, cost, done, info, available_actions = env.step(action)
+                write_shared(i, ob, s_ob, available_actions, reward, cost, done)
+                infos.append(info)
+            # environments whose agents are all done are reset in place
+            for i in np.flatnonzero(shared['dones'].all(axis=1)):
+                write_shared(i, *envs[i].reset())
+            remote.send(infos)
+        elif cmd == CMD_RESET:
+            for i, env in enumerate(envs):
+                write_shared(i, *env.reset())
+            remote.send(None)
+        elif cmd == CMD_RESET_TASK:
+            remote.send([env.reset_task() for env in envs])
+        elif cmd == CMD_RENDER:
             if data == 'rgb_array':
-                fr = env.render(mode=data)
-                remote.send(fr)
+                remote.send([env.render(mode=data) for env in envs])
             elif data == 'human':
-                env.render(mode=data)
-        elif cmd == 'close':
-            env.close()
+                for env in envs:
+                    env.render(mode=data)
+        elif cmd == CMD_CLOSE:
+            for env in envs:
+                env.close()
             remote.close()
+            shared.clear()
+            for shm in shared_memories:
+                shm.close()
             break
-        elif cmd == 'get_spaces':
-            remote.send((env.observation_spaces, env.share_observation_spaces, env.action_spaces))
-        elif cmd == 'render_vulnerability':
-            fr = env.render_vulnerability(data)
-            remote.send(fr)
-        elif cmd == 'get_num_agents':
-            remote.send(env.num_agents)
+        elif cmd == CMD_ATTACH_SHARED_MEMORY:
+            env_slice, layout = data
+            for key, (name, shape, dtype) in layout.items():
+                shm = shared_memory.SharedMemory(name=name)
+                shared_memories.append(shm)
+                shared[key] = np.ndarray(shape, dtype=dtype, buffer=shm.buf)[env_slice]
+        elif cmd == CMD_GET_SPACES:
+            remote.send((envs[0].observation_spaces, envs[0].share_observation_spaces, envs[0].action_spaces))
+        elif cmd == CMD_RENDER_VULNERABILITY:
+            remote.send([env.render_vulnerability(data) for env in envs])
+        elif cmd == CMD_GET_NUM_AGENTS:
+            remote.send(envs[0].num_agents)
         else:
             raise NotImplementedError
 
 
 class ShareSubprocVecEnv(ShareVecEnv):
-    def __init__(self, env_fns, device=torch.device("cpu")):
+    def __init__(self, env_fns, device=torch.device("cpu"), num_workers=None, start_method=None, running_obs_norm=False):
         self.waiting = False
         self.closed = False
         self.device = device
         nenvs = len(env_fns)
-        self.remotes, self.work_remotes = zip(*[Pipe() for _ in range(nenvs)])
+        # each worker process steps a contiguous block of environments, so one
+        # pipe round trip advances several of them
+        if num_workers is None:
+            num_workers = os.cpu_count() or 1
+        num_workers = max(1, min(num_workers, nenvs))
+        bounds = np.linspace(0, nenvs, num_workers + 1).astype(int)
+        self.env_slices = [slice(start, stop) for start, stop in zip(bounds[:-1], bounds[1:])]
+        # on Linux, forked workers inherit env_fns copy-on-write instead of
+        # unpickling them; other platforms keep their default start method
+        if start_method is None and sys.platform.startswith("linux"):
+            start_method = 'fork'
+        ctx = multiprocessing.get_context(start_method)
+        self.remotes, self.work_remotes = zip(*[ctx.Pipe() for _ in range(num_workers)])
         self.ps = [
-            Process(target=shareworker, args=(work_remote, remote, CloudpickleWrapper(env_fn)))
-            for (work_remote, remote, env_fn) in zip(self.work_remotes, self.remotes, env_fns)
+            ctx.Process(target=shareworker, args=(work_remote, remote, CloudpickleWrapper(env_fns[env_slice])))
+            for (work_remote, remote, env_slice) in zip(self.work_remotes, self.remotes, self.env_slices)
         ]
+        if os.name == 'posix':
+            # start the resource tracker before the workers exist so they share it;
+            # a forked worker would otherwise launch its own, which unlinks the
+            # segments it attached to (and warns they leaked) when the worker exits
+            resource_tracker.ensure_running()
         for p in self.ps:
             p.daemon = True  # if the main process crashes, we should not cause things to hang
             p.start()
         for remote in self.work_remotes:
             remote.close()
-        self.remotes[0].send(('get_num_agents', None))
+        send_command(self.remotes[0], CMD_GET_NUM_AGENTS)
         self.num_agents = self.remotes[0].recv()
-        self.remotes[0].send(('get_spaces', None))
+        send_command(self.remotes[0], CMD_GET_SPACES)
         observation_space, share_observation_space, action_space = self.remotes[0].recv()
         ShareVecEnv.__init__(
             self, len(env_fns), observation_space, share_observation_space, action_space
         )
+        self._attach_shared_memory()
+        self._init_obs_rms(running_obs_norm)
+
+    def _attach_shared_memory(self):
+        n_actions = max(space.shape[0] for space in self._action_space.values())
+        layout = dict(self._result_layout(), actions=((self.num_agents, n_actions), np.float32))
+        self.shared_memories = {}
+        buffers = {}
+        for key, (shape, dtype) in layout.items():
+            shape = (self.num_envs, *shape)
+            shm = shared_memory.SharedMemory(create=True, size=int(np.prod(shape)) * np.dtype(dtype).itemsize)
+            self.shared_memories[key] = shm
+            buffers[key] = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+        # the segments are unlinked on close, or when the vec env is collected
+        # or the interpreter exits without close() having been called
+        self._release_shared_memories = weakref.finalize(
+            self, release_shared_memories, list(self.shared_memories.values())
+        )
+        for env_slice, remote in zip(self.env_slices, self.remotes):
+            send_command(remote, CMD_ATTACH_SHARED_MEMORY, (env_slice, {
+                key: (shm.name, buffers[key].shape, buffers[key].dtype.str)
+                for key, shm in self.shared_memories.items()
+            }))
+        self.action_buffer = torch.from_numpy(buffers.pop('actions'))
+        self.result_buffers = buffers
+        self._allocate_result_tensors()
 
     def step_async(self, actions):
-        env_actions = torch.transpose(torch.stack(actions), 1, 0)
-        for remote, action in zip(self.remotes, env_actions):
-            remote.send(('step', action))
+        # all actions are written into shared memory at once, the step command
+        # itself carries no payload
+        self.action_buffer.copy_(torch.transpose(torch.stack(actions), 1, 0))
+        for remote in self.remotes:
+            send_command(remote, CMD_STEP)
         self.waiting = True
 
     def step_wait(self):
-        results = [remote.recv() for remote in self.remotes]
+        infos = [info for remote in self.remotes for info in remote.recv()]
         self.waiting = False
-        obs, share_obs, rews, costs, dones, infos, available_actions = zip(*results)
-        obs, share_obs, rews, costs, dones, available_actions = map(
-            lambda x: torch.tensor(np.stack(x), device=self.device), (obs, share_obs, rews, costs, dones, available_actions)
+        self._normalize_obs_results()
+        obs, share_obs, rews, costs, dones, available_actions = self._read_results(
+            'obs', 'share_obs', 'rews', 'costs', 'dones', 'available_actions'
         )
+        share_obs = share_obs.unsqueeze(1).expand(-1, self.num_agents, -1)
         return obs, share_obs, rews, costs, dones, infos, available_actions
 
     def reset(self):
         for remote in self.remotes:
-            remote.send(('reset', None))
-        results = [remote.recv() for remote in self.remotes]
-        obs, share_obs, available_actions = map(
-            lambda x: torch.tensor(np.stack(x), device=self.device), zip(*results)
-        )
+            send_command(remote, CMD_RESET)
+        for remote in self.remotes:
+            remote.recv()
+        self._normalize_obs_results()
+        obs, share_obs, available_actions = self._read_results('obs', 'share_obs', 'available_actions')
+        share_obs = share_obs.unsqueeze(1).expand(-1, self.num_agents, -1)
         return obs, share_obs, available_actions
 
+    def close_extras(self):
+        if self.waiting:
+            for remote in self.remotes:
+                remote.recv()
+        for remote in self.remotes:
+            send_command(remote, CMD_CLOSE)
+        for p in self.ps:
+            p.join()
+        self.action_buffer = None
+        self.result_buffers = {}
+        self.result_tensors = {}
+        self._release_shared_memories()
+
     
 
 class ShareDummyVecEnv(ShareVecEnv):
-    def __init__(self, env_fns, device=torch.device("cpu")):
+    def __init__(self, env_fns, device=torch.device("cpu"), running_obs_norm=False):
         self.envs = [fn() for fn in env_fns]
         self.num_env = len(env_fns)
         assert self.num_env == 1, "num_env support 1"
@@ -499,35 +745,55 @@ class ShareDummyVecEnv(ShareVecEnv):
             self, len(env_fns), env.observation_spaces, env.share_observation_spaces, env.action_spaces
         )
         self.actions = None
+        self.result_buffers = {
+            key: np.empty((self.num_env, *shape), dtype=dtype)
+            for key, (shape, dtype) in self._result_layout().items()
+        }
+        self._allocate_result_tensors()
+        self._init_obs_rms(running_obs_norm)
+
+    def _write_results(self, i, ob, s_ob, available_actions):
+        self.result_buffers['obs'][i] = ob
+        self.result_buffers['share_obs'][i] = s_ob[0]
+        self.result_buffers['available_actions'][i] = available_actions
 
     def step_async(self, actions):
         env_actions = torch.transpose(torch.stack(actions), 1, 0)
         self.actions = env_actions
 
     def step_wait(self):
-        results = [env.step(a) for (a, env) in zip(self.actions, self.envs)]
-        obs, share_obs, rews, cos, dones, infos, available_actions = map(np.array, zip(*results))
         self.total_step += 1
         total_steps = 0
-        for i, done in enumerate(dones):
-            if np.all(done):
-                obs[i], share_obs[i], available_actions[i] = self.envs[i].reset()
-                if self.num_env==1:
-                    total_steps = self.total_step
-                    self.total_step=0
+        infos = []
+        for i, (a, env) in enumerate(zip(self.actions, self.envs)):
+            ob, s_ob, rew, cos, done, info, available_actions = env.step(a)
+            self.result_buffers['rews'][i] = rew
+            self.result_buffers['costs'][i] = cos
+            self.result_buffers['dones'][i] = done
+            infos.append(info)
+            self._write_results(i, ob, s_ob, available_actions)
+        # environments whose agents are all done are reset in place
+        for i in np.flatnonzero(self.result_buffers['dones'].all(axis=1)):
+            self._write_results(i, *self.envs[i].reset())
+            if self.num_env==1:
+                total_steps = self.total_step
+                self.total_step=0
         self.actions = None
+        self._normalize_obs_results()
 
-        obs, share_obs, rews, cos, dones, available_actions = map(
-            lambda x: torch.tensor(x).to(self.device), (obs, share_obs, rews, cos, dones, available_actions)
+        obs, share_obs, rews, cos, dones, available_actions = self._read_results(
+            'obs', 'share_obs', 'rews', 'costs', 'dones', 'available_actions'
         )
+        share_obs = share_obs.unsqueeze(1).expand(-1, self.num_agents, -1)
 
         return obs, share_obs, rews, cos, dones, infos, available_actions, total_steps
 
     def reset(self):
-        results = [env.reset() for env in self.envs]
-        obs, share_obs, available_actions = map(
-            lambda x: torch.tensor(np.stack(x), device=self.device), zip(*results)
-        )
+        for i, env in enumerate(self.envs):
+            self._write_results(i, *env.reset())
+        self._normalize_obs_results()
+        obs, share_obs, available_actions = self._read_results('obs', 'share_obs', 'available_actions')
+        share_obs = share_obs.unsqueeze(1).expand(-1, self.num_agents, -1)
         if self.num_env==1:
             self.total_step=0
         return obs, share_obs, available_actions
@@ -22,6 +22,7 @@ except:
     pass
 import torch
 import torch.nn as nn
+from torch._utils import _flatten_dense_tensors, _unflatten_dense_tensors
 import os
 import sys
 import time
@@ -65,12 +66,39 @@ class MACPO_Policy():
             self.cost_critic.parameters(), lr=self.config["critic_lr"], eps=self.config["opti_eps"], weight_decay=self.config["weight_decay"]
             )
 
+        # actor, critic and cost critic share no layers, so on GPU their
+        # forwards are issued on separate streams and allowed to overlap
+        self.streams = None
+        if torch.device(self.config["device"]).type == "cuda":
+            self.streams = [torch.cuda.Stream(device=self.config["device"]) for _ in range(3)]
+
+    def run_forwards(self, *forwards):
+        if self.streams is None:
+            return [forward() for forward in forwards]
+        current_stream = torch.cuda.current_stream(self.config["device"])
+        outputs = []
+        for stream, forward in zip(self.streams, forwards):
+            stream.wait_stream(current_stream)
+            with torch.cuda.stream(stream):
+                outputs.append(forward())
+        for stream in self.streams:
+            current_stream.wait_stream(stream)
+        # the outputs are consumed and freed on the current stream, so the
+        # caching allocator must not hand their blocks back to the side streams
+        for output in outputs:
+            for tensor in output:
+                if isinstance(tensor, torch.Tensor):
+                    tensor.record_stream(current_stream)
+        return outputs
+
     def get_actions(self, cent_obs, obs, rnn_states_actor, rnn_states_critic, masks, available_actions=None,
                     deterministic=False, rnn_states_cost=None):
-        actions, action_log_probs, rnn_states_actor = self.actor(obs, rnn_states_actor, masks, available_actions, deterministic)
-
-        values, rnn_states_critic = self.critic(cent_obs, rnn_states_critic, masks)
-        cost_preds, rnn_states_cost = self.cost_critic(cent_obs, rnn_states_cost, masks)
+        (actions, action_log_probs, rnn_states_actor), (values, rnn_states_critic), (cost_preds, rnn_states_cost) \
+            = self.run_forwards(
+                lambda: self.actor(obs, rnn_states_actor, masks, available_actions, deterministic),
+                lambda: self.critic(cent_obs, rnn_states_critic, masks),
+                lambda: self.cost_critic(cent_obs, rnn_states_cost, masks),
+            )
         return values, actions, action_log_probs, rnn_states_actor, rnn_states_critic, cost_preds, rnn_states_cost
 
     def get_values(self, cent_obs, rnn_states_critic, masks):
@@ -83,10 +111,12 @@ class MACPO_Policy():
 
     def evaluate_actions(self, cent_obs, obs, rnn_states_actor, rnn_states_critic, action, masks,
                          available_actions=None, active_masks=None, rnn_states_cost=None):
-        action_log_probs, dist_entropy, action_mu, action_std \
-            = self.actor.evaluate_actions(obs, rnn_states_actor, action, masks, available_actions, active_masks)
-        values, _ = self.critic(cent_obs, rnn_states_critic, masks)
-        cost_values, _ = self.cost_critic(cent_obs, rnn_states_cost, masks)
+        (action_log_probs, dist_entropy, action_mu, action_std), (values, _), (cost_values, _) \
+            = self.run_forwards(
+                lambda: self.actor.evaluate_actions(obs, rnn_states_actor, action, masks, available_actions, active_masks),
+                lambda: self.critic(cent_obs, rnn_states_critic, masks),
+                lambda: self.cost_critic(cent_obs, rnn_states_cost, masks),
+            )
         return values, action_log_probs, dist_entropy, cost_values, action_mu, action_std
 
     def act(self, obs, rnn_states_actor, masks, available_actions=None, deterministic=False):
@@ -102,6 +132,11 @@ class MACPO_Trainer():
 
         self.value_normalizer = PopArt(1, device=self.config["device"])
         self.tpdv = dict(dtype=torch.float32, device=self.config["device"])
+        # step sizes tried by the line search, kept on device so each
+        # candidate update is a single tensor op
+        self.ls_step_sizes = self.config["fraction_coef"] * self.config["line_search_fraction"] ** torch.arange(
+            self.config["ls_step"], **self.tpdv
+        )
 
     def cal_value_loss(self, values, value_preds_batch, return_batch, active_masks_batch):
         value_pred_clipped = value_preds_batch + (values - value_preds_batch).clamp(-self.config["clip_param"],
@@ -117,44 +152,20 @@ class MACPO_Trainer():
         return value_loss.mean()
 
     def flat_grad(self, grads):
-        grad_flatten = []
-        for grad in grads:
-            if grad is None:
-                continue
-            grad_flatten.append(grad.view(-1))
-        grad_flatten = torch.cat(grad_flatten)
-        return grad_flatten
+        return torch.cat([grad.reshape(-1) for grad in grads if grad is not None])
 
     def flat_hessian(self, hessians):
-        hessians_flatten = []
-        for hessian in hessians:
-            if hessian is None:
-                continue
-            hessians_flatten.append(hessian.contiguous().view(-1))
-        hessians_flatten = torch.cat(hessians_flatten).data
-        return hessians_flatten
+        return torch.cat([hessian.reshape(-1) for hessian in hessians if hessian is not None]).data
 
     def flat_params(self, model):
-        params = []
-        for param in model.parameters():
-            params.append(param.data.view(-1))
-        params_flatten = torch.cat(params)
-        return params_flatten
+        return _flatten_dense_tensors([param.data for param in model.parameters()])
 
     def update_model(self, model, new_params):
-        index = 0
-        for params in model.parameters():
-            params_length = len(params.view(-1))
-            new_param = new_params[index: index + params_length]
-            new_param = new_param.view(params.size())
-            params.data.copy_(new_param)
-            index += params_length
-
-    def kl_divergence(self, obs, rnn_states, action, masks, available_actions, active_masks, new_actor, old_actor):
-
-        _, _, mu, std = new_actor.evaluate_actions(obs, rnn_states, action, masks, available_actions, active_masks)
-        _, _, mu_old, std_old = old_actor.evaluate_actions(obs, rnn_states, action, masks, available_actions,
-                                                           active_masks)
+        params = list(model.parameters())
+        for param, new_param in zip(params, _unflatten_dense_tensors(new_params, params)):
+            param.data.copy_(new_param)
+
+    def kl_divergence(self, mu, std, mu_old, std_old):
         logstd = torch.log(std)
         mu_old = mu_old.detach()
         std_old = std_old.detach()
@@ -165,34 +176,38 @@ class MACPO_Trainer():
 
         return kl.sum(1, keepdim=True)
 
-    def conjugate_gradient(self, actor, obs, rnn_states, action, masks, available_actions, active_masks, b, nsteps,
-                           residual_tol=1e-10):
-        x = torch.zeros(b.size()).to(device=self.config["device"])
+    def conjugate_gradient(self, actor, kl_grad, b, nsteps, residual_tol=1e-10):
+        x = torch.zeros_like(b)
         r = b.clone()
         p = b.clone()
         rdotr = torch.dot(r, r)
+        # Convergence is tracked as a device tensor and masks the remaining
+        # updates, so the loop never blocks on a host sync.
+        active = rdotr >= residual_tol
+        zero = torch.zeros_like(rdotr)
         for _ in range(nsteps):
-            _Avp = self.fisher_vector_product(actor, obs, rnn_states, action, masks, available_actions, active_masks, p)
-            alpha = rdotr / (torch.dot(p, _Avp)+1e-8)
-            x += alpha * p
-            r -= alpha * _Avp
+            _Avp = self.fisher_vector_product(actor, kl_grad, p)
+            alpha = torch.where(active, rdotr / (torch.dot(p, _Avp)+1e-8), zero)
+            x.add_(alpha * p)
+            r.sub_(alpha * _Avp)
             new_rdotr = torch.dot(r, r)
-            betta = new_rdotr / rdotr
+            betta = torch.where(active, new_rdotr / rdotr, zero)
             p = r + betta * p
             rdotr = new_rdotr
-            if rdotr < residual_tol:
-                break
+            active = active & (rdotr >= residual_tol)
         return x
 
-    def fisher_vector_product(self, actor, obs, rnn_states, action, masks, available_actions, active_masks, p):
-        p.detach()
-        kl = self.kl_divergence(obs, rnn_states, action, masks, available_actions, active_masks, new_actor=actor,
-                                old_actor=actor).mean()
+    def kl_gradient(self, actor, obs, rnn_states, action, masks, available_actions, active_masks):
+        _, _, mu, std = actor.evaluate_actions(obs, rnn_states, action, masks, available_actions, active_masks)
+        kl = self.kl_divergence(mu, std, mu, std).mean()
         kl_grad = torch.autograd.grad(kl, actor.parameters(), create_graph=True, allow_unused=True)
-        kl_grad = self.flat_grad(kl_grad)
+        return self.flat_grad(kl_grad)
 
+    def fisher_vector_product(self, actor, kl_grad, p):
+        # kl_grad is built once per mini batch by kl_gradient, so its graph
+        # has to be retained across the repeated products.
         kl_grad_p = (kl_grad * p).sum()
-        kl_hessian_p = torch.autograd.grad(kl_grad_p, actor.parameters(), allow_unused=True)
+        kl_hessian_p = torch.autograd.grad(kl_grad_p, actor.parameters(), retain_graph=True, allow_unused=True)
         kl_hessian_p = self.flat_hessian(kl_hessian_p)
 
         return kl_hessian_p + 0.1 * p
@@ -231,7 +246,11 @@ class MACPO_Trainer():
         self.policy.cost_optimizer.step()
 
 
-        rescale_constraint_val = (aver_episode_costs.mean() - self.config["safety_bound"]) * (1 - self.config["gamma"])
+        # The constraint value drives the Python case analysis below, so it is
+        # read back to the host once instead of on every comparison.
+        rescale_constraint_val = (
+            (aver_episode_costs.mean() - self.config["safety_bound"]) * (1 - self.config["gamma"])
+        ).item()
 
         if rescale_constraint_val == 0:
             rescale_constraint_val = 1e-8
@@ -246,20 +265,19 @@ class MACPO_Trainer():
         reward_loss_grad = self.flat_grad(reward_loss_grad)
 
         cost_loss = torch.sum(ratio * factor_batch * (cost_adv_targ), dim=-1, keepdim=True).mean()
-        cost_loss_grad = torch.autograd.grad(cost_loss, self.policy.actor.parameters(), retain_graph=True,
-                                             allow_unused=True)
+        # last use of the surrogate graph, so its buffers are released here
+        cost_loss_grad = torch.autograd.grad(cost_loss, self.policy.actor.parameters(), allow_unused=True)
         cost_loss_grad = self.flat_grad(cost_loss_grad)
         B_cost_loss_grad = cost_loss_grad.unsqueeze(0)
         B_cost_loss_grad = self.flat_grad(B_cost_loss_grad)
 
-        g_step_dir = self.conjugate_gradient(
+        kl_grad = self.kl_gradient(
             self.policy.actor, obs_batch, rnn_states_batch, actions_batch, masks_batch,\
-            available_actions_batch, active_masks_batch, reward_loss_grad.data, nsteps=10
-        )  
-        b_step_dir = self.conjugate_gradient(
-            self.policy.actor, obs_batch, rnn_states_batch, actions_batch, masks_batch,\
-            available_actions_batch, active_masks_batch, B_cost_loss_grad.data, nsteps=10
-        )  
+            available_actions_batch, active_masks_batch
+        )
+        g_step_dir = self.conjugate_gradient(self.policy.actor, kl_grad, reward_loss_grad.data, nsteps=10)
+        b_step_dir = self.conjugate_gradient(self.policy.actor, kl_grad, B_cost_loss_grad.data, nsteps=10)
+        del kl_grad
 
         q_coef = (reward_loss_grad * g_step_dir).sum(0, keepdim=True)  
         r_coef = (reward_loss_grad * b_step_dir).sum(0, keepdim=True)  
@@ -269,7 +287,7 @@ class MACPO_Trainer():
         loss_improve = 0
 
         B_cost_loss_grad_dot = torch.dot(B_cost_loss_grad, B_cost_loss_grad)
-        if (torch.dot(B_cost_loss_grad, B_cost_loss_grad)) <= 1e-8 and rescale_constraint_val < 0:
+        if rescale_constraint_val < 0 and B_cost_loss_grad_dot <= 1e-8:
             b_step_dir = torch.tensor(0)
             r_coef = torch.tensor(0)
             s_coef = torch.tensor(0)
@@ -308,7 +326,7 @@ class MACPO_Trainer():
             LA, LB = (LA, LB) if rescale_constraint_val < 0 else (LB, LA)
             proj = lambda x, L: max(L[0], min(L[1], x))
             lam_a = proj(torch.sqrt(positive_Cauchy_value / whether_recover_policy_value), LA)
-            lam_b = proj(torch.sqrt(q_coef / (torch.tensor(2 * self.config["kl_threshold"]))), LB)
+            lam_b = proj(torch.sqrt(q_coef / (2 * self.config["kl_threshold"])), LB)
 
             f_a = lambda lam: -0.5 * (positive_Cauchy_value / (
                         1e-8 + lam) + whether_recover_policy_value * lam) - r_coef * rescale_constraint_val / (
@@ -318,7 +336,8 @@ class MACPO_Trainer():
             nu = max(0, lam * rescale_constraint_val - r_coef) / (1e-8 + s_coef)
         else:
             lam = torch.tensor(0)
-            nu = torch.sqrt(torch.tensor(2 * self.config["kl_threshold"]) / (1e-8 + s_coef))
+            # s_coef falls back to a Python float when the cost step direction vanishes
+            nu = torch.sqrt(torch.as_tensor(2 * self.config["kl_threshold"] / (1e-8 + s_coef)))
 
         x_a = (1. / (lam + 1e-8)) * (g_step_dir + nu * b_step_dir)
         x_b = (nu * b_step_dir)
@@ -328,89 +347,89 @@ class MACPO_Trainer():
         cost_loss = cost_loss.detach()
         params = self.flat_params(self.policy.actor)
 
-        old_actor = Actor(self.policy.config,
-                            self.policy.obs_space,
-                            self.policy.act_space,
-                            self.config["device"])
-        self.update_model(old_actor, params)
+        # The line search only needs the old action distribution, which is
+        # evaluated once here instead of through a rebuilt copy of the actor.
+        with torch.no_grad():
+            _, _, mu_old, std_old = self.policy.actor.evaluate_actions(
+                obs_batch, rnn_states_batch, actions_batch, masks_batch, available_actions_batch, active_masks_batch
+            )
 
         expected_improve = -torch.dot(x, reward_loss_grad).sum(0, keepdim=True)
-        expected_improve = expected_improve.detach()
 
         flag = False
-        fraction_coef = self.config["fraction_coef"]
+        x_norm = torch.norm(x)
+        x = x * torch.clamp(0.5 / x_norm, max=1.0)
         for i in range(self.config["ls_step"]):
-            x_norm = torch.norm(x)
-            if x_norm > 0.5:
-                x = x * 0.5 / x_norm
-
-            new_params = params - fraction_coef * (fraction**i) * x
+            new_params = params - self.ls_step_sizes[i] * x
             self.update_model(self.policy.actor, new_params)
-            values, action_log_probs, dist_entropy, new_cost_values, action_mu, action_std = self.policy.evaluate_actions(
-                share_obs_batch, obs_batch, rnn_states_batch, rnn_states_critic_batch,\
-                actions_batch, masks_batch, available_actions_batch, active_masks_batch, rnn_states_cost_batch
-            )
+            # A single actor forward per candidate yields both the surrogate
+            # losses and the KL; the critics are not needed here.
+            with torch.no_grad():
+                action_log_probs, dist_entropy, action_mu, action_std = self.policy.actor.evaluate_actions(
+                    obs_batch, rnn_states_batch, actions_batch, masks_batch, available_actions_batch, active_masks_batch
+                )
+
+                ratio = torch.exp(action_log_probs - old_action_log_probs_batch)
+                ratio = torch.prod(ratio, dim=-1, keepdim=True)
 
-            ratio = torch.exp(action_log_probs - old_action_log_probs_batch)
-            ratio = torch.prod(ratio, dim=-1, keepdim=True)
+                new_reward_loss = torch.sum(ratio * factor_batch * adv_targ, dim=-1, keepdim=True).mean()
+                new_cost_loss = torch.sum(ratio * factor_batch * cost_adv_targ, dim=-1, keepdim=True).mean()
 
-            new_reward_loss = torch.sum(ratio * factor_batch * adv_targ, dim=-1, keepdim=True).mean()
-            new_cost_loss = torch.sum(ratio * factor_batch * cost_adv_targ, dim=-1, keepdim=True).mean()
+                new_reward_loss = -new_reward_loss
+                loss_improve = new_reward_loss - reward_loss
 
-            new_reward_loss = new_reward_loss.detach()
-            new_reward_loss = -new_reward_loss
-            new_cost_loss = new_cost_loss.detach()
-            loss_improve = new_reward_loss - reward_loss
+                kl = self.kl_divergence(action_mu, action_std, mu_old, std_old).mean()
 
-            kl = self.kl_divergence(
-                obs_batch, rnn_states_batch, actions_batch, masks_batch,\
-                available_actions_batch, active_masks_batch, new_actor=self.policy.actor, old_actor=old_actor
-            ).mean()
+                # all accept conditions are combined on device and read back once
+                accept = (kl < self.config["kl_threshold"]) \
+                    & (new_cost_loss.mean() - cost_loss.mean() <= max(-rescale_constraint_val, 0))
+                if optim_case > 1:
+                    accept = accept & (loss_improve < 0).all()
 
-            if ((kl < self.config["kl_threshold"]) and (loss_improve < 0 if optim_case > 1 else True)
-                    and (new_cost_loss.mean() - cost_loss.mean() <= max(-rescale_constraint_val, 0))):
+            if accept.item():
                 flag = True
                 break
             expected_improve *= fraction
 
         if not flag:
-            params = self.flat_params(old_actor)
             self.update_model(self.policy.actor, params)
 
         return value_loss, critic_grad_norm, kl, loss_improve, expected_improve, dist_entropy, ratio, cost_loss, cost_grad_norm, whether_recover_policy_value, cost_preds_batch, cost_returns_barch, B_cost_loss_grad, lam, nu, g_step_dir, b_step_dir, x, action_mu, action_std, B_cost_loss_grad_dot
 
     def train(self, buffer, logger):
+        # Both advantages are standardized once over the whole rollout, in place
+        # on the freshly computed tensors, before any mini batch is drawn.
         advantages = buffer.returns[:-1] - self.value_normalizer.denormalize(buffer.value_preds[:-1])
-
-        advantages_copy = advantages.clone()
-        mean_advantages = torch.mean(advantages_copy)
-        std_advantages = torch.std(advantages_copy)
-        advantages = (advantages - mean_advantages) / (std_advantages + 1e-5)
+        advantages.sub_(advantages.mean()).div_(advantages.std() + 1e-5)
 
         cost_adv = buffer.cost_returns[:-1] - self.value_normalizer.denormalize(buffer.cost_preds[:-1])
-
-        cost_adv_copy = cost_adv.clone()
-        mean_cost_adv = cost_adv_copy.mean()
-        std_cost_adv = cost_adv_copy.std()
-        cost_adv = (cost_adv - mean_cost_adv) / (std_cost_adv + 1e-5)
+        cost_adv.sub_(cost_adv.mean()).div_(cost_adv.std() + 1e-5)
 
         data_generator = buffer.feed_forward_generator(advantages, self.config["num_mini_batch"], cost_adv=cost_adv)
         for sample in data_generator:
             value_loss, critic_grad_norm, kl, loss_improve, expected_improve, dist_entropy, imp_weights, cost_loss, cost_grad_norm, whether_recover_policy_value, cost_preds_batch, cost_returns_barch, B_cost_loss_grad, lam, nu, g_step_dir, b_step_dir, x, action_mu, action_std, B_cost_loss_grad_dot \
                 = self.trpo_update(sample)
                 
+            # the logged scalars are read back to the host in one transfer
+            metrics = torch.cat([metric.reshape(1) for metric in (
+                value_loss, cost_loss, loss_improve, expected_improve, critic_grad_norm,
+                cost_grad_norm, dist_entropy, imp_weights.mean(), kl,
+            )]).tolist()
             logger.store(
-                **{
-                    "Loss/Loss_reward_critic": value_loss.item(),
-                    "Loss/Loss_cost_critic": cost_loss.item(),
-                    "Loss/Loss_actor_improve": loss_improve.item(),
-                    "Loss/Loss_actor_expected_improve": expected_improve.item(),
-                    "Misc/Reward_critic_norm": critic_grad_norm.item(),
-                    "Misc/Cost_critic_norm": cost_grad_norm.item(),
-                    "Misc/Entropy": dist_entropy.item(),
-                    "Misc/Ratio": imp_weights.detach().mean().item(),
-                    "Misc/KL": kl.detach().item(),
-                }
+                **dict(zip(
+                    (
+                        "Loss/Loss_reward_critic",
+                        "Loss/Loss_cost_critic",
+                        "Loss/Loss_actor_improve",
+                        "Loss/Loss_actor_expected_improve",
+                        "Misc/Reward_critic_norm",
+                        "Misc/Cost_critic_norm",
+                        "Misc/Entropy",
+                        "Misc/Ratio",
+                        "Misc/KL",
+                    ),
+                    metrics,
+                ))
             )
 
     def prep_training(self):
@@ -491,8 +510,11 @@ class Runner:
 
         for episode in range(episodes):
 
-            done_episodes_rewards = []
-            done_episodes_costs = []
+            # Finished episodes are accumulated as on-device sums and counts,
+            # so the step loop never needs a data-dependent shape.
+            done_episodes_rewards = torch.zeros((), device=self.config["device"])
+            done_episodes_costs = torch.zeros((), device=self.config["device"])
+            done_episodes_count = torch.zeros((), device=self.config["device"])
 
             for step in range(self.config["episode_length"]):
                 # Sample actions
@@ -501,21 +523,17 @@ class Runner:
                 obs, share_obs, rewards, costs, dones, infos, _, current_total_steps = self.envs.step(actions)
 
                 dones_env = torch.all(dones, dim=1)
-                reward_env = torch.mean(rewards.float(), dim=1).flatten()
-                cost_env = torch.mean(costs.float(), dim=1).flatten()
-
                 reward_env = torch.mean(rewards, dim=1).flatten()
                 cost_env = torch.mean(costs, dim=1).flatten()
 
                 train_episode_rewards += reward_env
                 train_episode_costs += cost_env
 
-                for t in range(self.config["n_rollout_threads"]):
-                    if dones_env[t]:
-                        done_episodes_rewards.append(train_episode_rewards[:, t].clone())
-                        train_episode_rewards[:, t] = 0
-                        done_episodes_costs.append(train_episode_costs[:, t].clone())
-                        train_episode_costs[:, t] = 0
+                done_episodes_rewards += (train_episode_rewards * dones_env).sum()
+                done_episodes_costs += (train_episode_costs * dones_env).sum()
+                done_episodes_count += dones_env.sum()
+                train_episode_rewards.masked_fill_(dones_env, 0)
+                train_episode_costs.masked_fill_(dones_env, 0)
 
                 done_episodes_costs_aver = train_episode_costs.mean()
                 data = obs, share_obs, rewards, costs, dones, infos, \
@@ -538,9 +556,9 @@ class Runner:
             if episode % self.config["eval_interval"] == 0 and self.config["use_eval"]:
                 eval_rewards, eval_costs = self.eval()
 
-            if len(done_episodes_rewards) != 0:
-                aver_episode_rewards = torch.stack(done_episodes_rewards).mean()
-                aver_episode_costs = torch.stack(done_episodes_costs).mean()
+            if done_episodes_count.item() != 0:
+                aver_episode_rewards = done_episodes_rewards / done_episodes_count
+                aver_episode_costs = done_episodes_costs / done_episodes_count
                 self.return_aver_cost(aver_episode_costs)
                 self.logger.store(
                     **{
@@ -608,13 +626,13 @@ class Runner:
                                                             self.buffer[agent_id].rnn_states_critic[step],
                                                             self.buffer[agent_id].masks[step],
                                                             rnn_states_cost=self.buffer[agent_id].rnn_states_cost[step])
-            value_collector.append(value.detach())
-            action_collector.append(action.detach())
-            action_log_prob_collector.append(action_log_prob.detach())
-            rnn_state_collector.append(rnn_state.detach())
-            rnn_state_critic_collector.append(rnn_state_critic.detach())
-            cost_preds_collector.append(cost_pred.detach())
-            rnn_states_cost_collector.append(rnn_state_cost.detach())
+            value_collector.append(value)
+            action_collector.append(action)
+            action_log_prob_collector.append(action_log_prob)
+            rnn_state_collector.append(rnn_state)
+            rnn_state_critic_collector.append(rnn_state_critic)
+            cost_preds_collector.append(cost_pred)
+            rnn_states_cost_collector.append(rnn_state_cost)
         if self.config["env_name"] == "Safety9|8HumanoidVelocity-v0":
             zeros = torch.zeros(action_collector[-1].shape[0], 1)
             action_collector[-1]=torch.cat((action_collector[-1], zeros), dim=1)
@@ -674,25 +692,28 @@ class Runner:
             available_actions = None if self.buffer[agent_id].available_actions is None \
                 else self.buffer[agent_id].available_actions[:-1].reshape(-1, *self.buffer[agent_id].available_actions.shape[2:])
 
-            old_actions_logprob, _, _, _ = self.trainer[agent_id].policy.actor.evaluate_actions(
-                self.buffer[agent_id].obs[:-1].reshape(-1, *self.buffer[agent_id].obs.shape[2:]),
-                self.buffer[agent_id].rnn_states[0:1].reshape(-1, *self.buffer[agent_id].rnn_states.shape[2:]),
-                self.buffer[agent_id].actions.reshape(-1, *self.buffer[agent_id].actions.shape[2:]),
-                self.buffer[agent_id].masks[:-1].reshape(-1, *self.buffer[agent_id].masks.shape[2:]),
-                available_actions,
-                self.buffer[agent_id].active_masks[:-1].reshape(-1, *self.buffer[agent_id].active_masks.shape[2:]))
+            # the full-batch log-probs only feed the factor update, so no graph is built for them
+            with torch.no_grad():
+                old_actions_logprob, _, _, _ = self.trainer[agent_id].policy.actor.evaluate_actions(
+                    self.buffer[agent_id].obs[:-1].reshape(-1, *self.buffer[agent_id].obs.shape[2:]),
+                    self.buffer[agent_id].rnn_states[0:1].reshape(-1, *self.buffer[agent_id].rnn_states.shape[2:]),
+                    self.buffer[agent_id].actions.reshape(-1, *self.buffer[agent_id].actions.shape[2:]),
+                    self.buffer[agent_id].masks[:-1].reshape(-1, *self.buffer[agent_id].masks.shape[2:]),
+                    available_actions,
+                    self.buffer[agent_id].active_masks[:-1].reshape(-1, *self.buffer[agent_id].active_masks.shape[2:]))
             self.trainer[agent_id].train(self.buffer[agent_id], logger=self.logger)
 
-            new_actions_logprob, _, _, _ = self.trainer[agent_id].policy.actor.evaluate_actions(
-                self.buffer[agent_id].obs[:-1].reshape(-1, *self.buffer[agent_id].obs.shape[2:]),
-                self.buffer[agent_id].rnn_states[0:1].reshape(-1, *self.buffer[agent_id].rnn_states.shape[2:]),
-                self.buffer[agent_id].actions.reshape(-1, *self.buffer[agent_id].actions.shape[2:]),
-                self.buffer[agent_id].masks[:-1].reshape(-1, *self.buffer[agent_id].masks.shape[2:]),
-                available_actions,
-                self.buffer[agent_id].active_masks[:-1].reshape(-1, *self.buffer[agent_id].active_masks.shape[2:]))
-
-            action_prod = torch.prod(torch.exp(new_actions_logprob.detach()-old_actions_logprob.detach()).reshape(self.config["episode_length"],self.config["n_rollout_threads"],action_dim), dim=-1, keepdim=True)
-            factor = factor*action_prod.detach()
+            with torch.no_grad():
+                new_actions_logprob, _, _, _ = self.trainer[agent_id].policy.actor.evaluate_actions(
+                    self.buffer[agent_id].obs[:-1].reshape(-1, *self.buffer[agent_id].obs.shape[2:]),
+                    self.buffer[agent_id].rnn_states[0:1].reshape(-1, *self.buffer[agent_id].rnn_states.shape[2:]),
+                    self.buffer[agent_id].actions.reshape(-1, *self.buffer[agent_id].actions.shape[2:]),
+                    self.buffer[agent_id].masks[:-1].reshape(-1, *self.buffer[agent_id].masks.shape[2:]),
+                    available_actions,
+                    self.buffer[agent_id].active_masks[:-1].reshape(-1, *self.buffer[agent_id].active_masks.shape[2:]))
+
+            action_prod = torch.prod(torch.exp(new_actions_logprob-old_actions_logprob).reshape(self.config["episode_length"],self.config["n_rollout_threads"],action_dim), dim=-1, keepdim=True)
+            factor = factor*action_prod
             self.buffer[agent_id].after_update()
 
     def save(self):
@@ -701,6 +722,8 @@ class Runner:
             torch.save(policy_actor.state_dict(), str(self.save_dir) + "/actor_agent" + str(agent_id) + ".pt")
             policy_critic = self.trainer[agent_id].policy.critic
             torch.save(policy_critic.state_dict(), str(self.save_dir) + "/critic_agent" + str(agent_id) + ".pt")
+        if getattr(self.envs, "obs_rms", None) is not None:
+            torch.save(self.envs.obs_rms_state_dict(), str(self.save_dir) + "/obs_rms.pt")
 
     def restore(self):
         for agent_id in range(self.num_agents):
@@ -708,6 +731,8 @@ class Runner:
             self.policy[agent_id].actor.load_state_dict(policy_actor_state_dict)
             policy_critic_state_dict = torch.load(str(self.model_dir) + '/critic_agent' + str(agent_id) + '.pt')
             self.policy[agent_id].critic.load_state_dict(policy_critic_state_dict)
+        if getattr(self.envs, "obs_rms", None) is not None:
+            self.envs.load_obs_rms_state_dict(torch.load(str(self.model_dir) + '/obs_rms.pt'))
 
     @torch.no_grad()
     def eval(self, eval_episodes=1):
@@ -717,6 +742,10 @@ class Runner:
         one_episode_rewards = torch.zeros(1, self.config["n_eval_rollout_threads"], device=self.config["device"])
         one_episode_costs = torch.zeros(1, self.config["n_eval_rollout_threads"], device=self.config["device"])
 
+        if getattr(self.eval_envs, "obs_rms", None) is not None:
+            # evaluate under the training statistics, without updating them
+            self.eval_envs.freeze_obs_rms(self.envs)
+
         eval_obs, _, _ = self.eval_envs.reset()
 
         eval_rnn_states = torch.zeros(self.config["n_eval_rollout_threads"], self.num_agents, self.config["recurrent_N"], self.config["hidden_size"],
@@ -780,13 +809,11 @@ class Runner:
             next_value = self.trainer[agent_id].policy.get_values(self.buffer[agent_id].share_obs[-1],
                                                                 self.buffer[agent_id].rnn_states_critic[-1],
                                                                 self.buffer[agent_id].masks[-1])
-            next_value = next_value.detach()
             self.buffer[agent_id].compute_returns(next_value, self.trainer[agent_id].value_normalizer)
 
             next_costs = self.trainer[agent_id].policy.get_cost_values(self.buffer[agent_id].share_obs[-1],
                                                                        self.buffer[agent_id].rnn_states_cost[-1],
                                                                        self.buffer[agent_id].masks[-1])
-            next_costs = next_costs.detach()
             self.buffer[agent_id].compute_cost_returns(next_costs, self.trainer[agent_id].value_normalizer)
 
 def train(args, cfg_train):
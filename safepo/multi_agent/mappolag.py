@@ -513,6 +513,8 @@ class Runner:
             torch.save(policy_actor.state_dict(), str(self.save_dir) + "/actor_agent" + str(agent_id) + ".pt")
             policy_critic = self.trainer[agent_id].policy.critic
             torch.save(policy_critic.state_dict(), str(self.save_dir) + "/critic_agent" + str(agent_id) + ".pt")
+        if getattr(self.envs, "obs_rms", None) is not None:
+            torch.save(self.envs.obs_rms_state_dict(), str(self.save_dir) + "/obs_rms.pt")
 
     def restore(self):
         for agent_id in range(self.num_agents):
@@ -520,6 +522,8 @@ class Runner:
             self.policy[agent_id].actor.load_state_dict(policy_actor_state_dict)
             policy_critic_state_dict = torch.load(str(self.model_dir) + '/critic_agent' + str(agent_id) + '.pt')
             self.policy[agent_id].critic.load_state_dict(policy_critic_state_dict)
+        if getattr(self.envs, "obs_rms", None) is not None:
+            self.envs.load_obs_rms_state_dict(torch.load(str(self.model_dir) + '/obs_rms.pt'))
 
     @torch.no_grad()
     def eval(self, eval_episodes=1):
@@ -529,6 +533,10 @@ class Runner:
         one_episode_rewards = torch.zeros(1, self.config["n_eval_rollout_threads"], device=self.config["device"])
         one_episode_costs = torch.zeros(1, self.config["n_eval_rollout_threads"], device=self.config["device"])
 
+        if getattr(self.eval_envs, "obs_rms", None) is not None:
+            # evaluate under the training statistics, without updating them
+            self.eval_envs.freeze_obs_rms(self.envs)
+
         eval_obs, _, _ = self.eval_envs.reset()
 
         eval_rnn_states = torch.zeros(self.config["n_eval_rollout_threads"], self.num_agents, self.config["recurrent_N"], self.config["hidden_size"],
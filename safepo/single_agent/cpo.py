@@ -16,6 +16,7 @@
 
 from __future__ import annotations
 
+import inspect
 import os
 import random
 import sys
@@ -29,8 +30,10 @@ try:
 except ImportError:
     pass
 import torch
+import torch.distributed as dist
 import torch.nn as nn
 import torch.optim
+from torch._utils import _flatten_dense_tensors, _unflatten_dense_tensors
 from torch.nn.utils.clip_grad import clip_grad_norm_
 from torch.utils.data import DataLoader, TensorDataset
 
@@ -64,39 +67,59 @@ isaac_gym_specific_cfg = {
 }
 
 
+def is_distributed() -> bool:
+    return dist.is_available() and dist.is_initialized()
+
+
+def distributed_avg(tensor: torch.Tensor) -> torch.Tensor:
+    """Average ``tensor`` in place over all ranks when launched with torchrun."""
+    if is_distributed():
+        dist.all_reduce(tensor, op=dist.ReduceOp.SUM)
+        tensor /= dist.get_world_size()
+    return tensor
+
+
+def multi_tensor_adam_kwargs(device: torch.device) -> dict:
+    """Pick the single-kernel Adam implementation available for ``device``."""
+    adam_params = inspect.signature(torch.optim.Adam).parameters
+    if device.type == "cuda" and "fused" in adam_params:
+        return {"fused": True}
+    if "foreach" in adam_params:
+        return {"foreach": True}
+    return {}
+
+
 def get_flat_params_from(model: torch.nn.Module) -> torch.Tensor:
-    flat_params = []
-    for _, param in model.named_parameters():
-        if param.requires_grad:
-            data = param.data
-            data = data.view(-1)  # flatten tensor
-            flat_params.append(data)
+    flat_params = [param.data for param in model.parameters() if param.requires_grad]
     assert flat_params, "No gradients were found in model parameters."
-    return torch.cat(flat_params)
+    return _flatten_dense_tensors(flat_params)
 
 
 def conjugate_gradients(
     fisher_product: Callable[[torch.Tensor], torch.Tensor],
     policy: ActorVCritic,
-    fvp_obs: torch.Tensor,
+    flat_grad_kl: torch.Tensor,
     vector_b: torch.Tensor,
     num_steps: int = 10,
     residual_tol: float = 1e-10,
     eps: float = 1e-6,
 ) -> torch.Tensor:
     vector_x = torch.zeros_like(vector_b)
-    vector_r = vector_b - fisher_product(vector_x, policy, fvp_obs)
+    vector_r = vector_b - fisher_product(vector_x, policy, flat_grad_kl)
     vector_p = vector_r.clone()
     rdotr = torch.dot(vector_r, vector_r)
+    # keep the stopping criterion on device: once converged, alpha is masked to
+    # zero so vector_x is frozen without a host sync per iteration
+    converged = torch.zeros((), dtype=torch.bool, device=vector_b.device)
 
     for _ in range(num_steps):
-        vector_z = fisher_product(vector_p, policy, fvp_obs)
+        vector_z = fisher_product(vector_p, policy, flat_grad_kl)
         alpha = rdotr / (torch.dot(vector_p, vector_z) + eps)
-        vector_x += alpha * vector_p
-        vector_r -= alpha * vector_z
+        alpha = torch.where(converged, torch.zeros_like(alpha), alpha)
+        vector_x.add_(alpha * vector_p)
+        vector_r.sub_(alpha * vector_z)
         new_rdotr = torch.dot(vector_r, vector_r)
-        if torch.sqrt(new_rdotr) < residual_tol:
-            break
+        converged = converged | (torch.sqrt(new_rdotr) < residual_tol)
         vector_mu = new_rdotr / (rdotr + eps)
         vector_p = vector_r + vector_mu * vector_p
         rdotr = new_rdotr
@@ -105,62 +128,81 @@ def conjugate_gradients(
 
 def set_param_values_to_model(model: torch.nn.Module, vals: torch.Tensor) -> None:
     assert isinstance(vals, torch.Tensor)
-    i: int = 0
-    for _, param in model.named_parameters():
-        if param.requires_grad:  # param has grad and, hence, must be set
-            orig_size = param.size()
-            size = np.prod(list(param.size()))
-            new_values = vals[i : int(i + size)]
-            # set new param values
-            new_values = new_values.view(orig_size)
-            param.data = new_values
-            i += int(size)  # increment array position
-    assert i == len(vals), f"Lengths do not match: {i} vs. {len(vals)}"
+    params = [param for param in model.parameters() if param.requires_grad]
+    size = sum(param.numel() for param in params)
+    assert size == len(vals), f"Lengths do not match: {size} vs. {len(vals)}"
+    for param, new_values in zip(params, _unflatten_dense_tensors(vals, params)):
+        param.data.copy_(new_values)
 
 
 def get_flat_gradients_from(model: torch.nn.Module) -> torch.Tensor:
-    grads = []
-    for _, param in model.named_parameters():
-        if param.requires_grad and param.grad is not None:
-            grad = param.grad
-            grads.append(grad.view(-1))  # flatten tensor and append
+    grads = [
+        param.grad.reshape(-1)
+        for param in model.parameters()
+        if param.requires_grad and param.grad is not None
+    ]
     assert grads, "No gradients were found in model parameters."
     return torch.cat(grads)
 
 
-def fvp(
-    params: torch.Tensor,
+def gaussian_kl(
+    mean_old: torch.Tensor,
+    std_old: torch.Tensor,
+    mean_new: torch.Tensor,
+    std_new: torch.Tensor,
+) -> torch.Tensor:
+    """Elementwise KL(old || new) between diagonal Gaussians, in closed form."""
+    return (
+        torch.log(std_new / std_old)
+        + (std_old.pow(2) + (mean_old - mean_new).pow(2)) / (2 * std_new.pow(2))
+        - 0.5
+    )
+
+
+def kl_gradient(
     policy: ActorVCritic,
     fvp_obs: torch.Tensor,
 ) -> torch.Tensor:
-    policy.actor.zero_grad()
+    """Flat KL gradient whose graph is kept for the repeated Fisher-vector products."""
     current_distribution = policy.actor(fvp_obs)
-    with torch.no_grad():
-        old_distribution = policy.actor(fvp_obs)
-    kl = torch.distributions.kl.kl_divergence(
-        old_distribution, current_distribution
-    ).mean()
+    mean, std = current_distribution.mean, current_distribution.stddev
+    kl = gaussian_kl(mean.detach(), std.detach(), mean, std).mean()
 
     grads = torch.autograd.grad(kl, tuple(policy.actor.parameters()), create_graph=True)
-    flat_grad_kl = torch.cat([grad.view(-1) for grad in grads])
+    return torch.cat([grad.reshape(-1) for grad in grads])
 
+
+def fvp(
+    params: torch.Tensor,
+    policy: ActorVCritic,
+    flat_grad_kl: torch.Tensor,
+) -> torch.Tensor:
     kl_p = (flat_grad_kl * params).sum()
     grads = torch.autograd.grad(
         kl_p,
         tuple(policy.actor.parameters()),
-        retain_graph=False,
+        retain_graph=True,
     )
 
-    flat_grad_grad_kl = torch.cat([grad.contiguous().view(-1) for grad in grads])
+    flat_grad_grad_kl = torch.cat([grad.reshape(-1) for grad in grads])
 
-    return flat_grad_grad_kl + params * 0.1
+    return distributed_avg(flat_grad_grad_kl + params * 0.1)
 
 
 def main(args, cfg_env=None):
+    # data-parallel training: each rank collects its own rollouts and the
+    # policy gradients, Fisher products and critic gradients are averaged
+    rank = 0
+    if int(os.environ.get("WORLD_SIZE", 1)) > 1:
+        if args.device == "cuda":
+            args.device_id = int(os.environ.get("LOCAL_RANK", 0))
+            torch.cuda.set_device(args.device_id)
+        dist.init_process_group(backend="nccl" if args.device == "cuda" else "gloo")
+        rank = dist.get_rank()
     # set the random seed, device and number of threads
-    random.seed(args.seed)
-    np.random.seed(args.seed)
-    torch.manual_seed(args.seed)
+    random.seed(args.seed + rank)
+    np.random.seed(args.seed + rank)
+    torch.manual_seed(args.seed + rank)
     torch.backends.cudnn.deterministic = True
     torch.set_num_threads(4)
     device = torch.device(f'{args.device}:{args.device_id}')
@@ -168,7 +210,7 @@ def main(args, cfg_env=None):
 
     if args.task not in isaac_gym_map.keys():
         env, obs_space, act_space = make_sa_mujoco_env(
-            num_envs=args.num_envs, env_id=args.task, seed=args.seed
+            num_envs=args.num_envs, env_id=args.task, seed=args.seed + rank
         )
         eval_env, _, _ = make_sa_mujoco_env(num_envs=1, env_id=args.task, seed=None)
         config = default_cfg
@@ -193,11 +235,30 @@ def main(args, cfg_env=None):
         act_dim=act_space.shape[0],
         hidden_sizes=config["hidden_sizes"],
     ).to(device)
+    if is_distributed():
+        for param in policy.parameters():
+            dist.broadcast(param.data, src=0)
+    # torch.compile cannot trace double backward, so only the no-grad KL of
+    # the line search is compiled; kl_gradient keeps the eager gaussian_kl.
+    if args.use_compile and hasattr(torch, "compile"):
+        line_search_kl = torch.compile(gaussian_kl, dynamic=False, fullgraph=True)
+    else:
+        line_search_kl = gaussian_kl
+    # the 0.001 * ||w||^2 critic penalty is applied as Adam weight decay, whose
+    # gradient 2 * 0.001 * w also carries the reward loss coefficient
+    critic_decay = 0.002 if config.get("use_critic_norm", True) else 0.0
+    reward_coef = 2 if config.get("use_value_coefficient", False) else 1
     reward_critic_optimizer = torch.optim.Adam(
-        policy.reward_critic.parameters(), lr=1e-3
+        policy.reward_critic.parameters(),
+        lr=1e-3,
+        weight_decay=reward_coef * critic_decay,
+        **multi_tensor_adam_kwargs(device),
     )
     cost_critic_optimizer = torch.optim.Adam(
-        policy.cost_critic.parameters(), lr=1e-3
+        policy.cost_critic.parameters(),
+        lr=1e-3,
+        weight_decay=critic_decay,
+        **multi_tensor_adam_kwargs(device),
     )
 
     # create the vectorized on-policy buffer
@@ -350,37 +411,46 @@ def main(args, cfg_env=None):
         data = buffer.get()
         fvp_obs = data["obs"][:: 1]
         theta_old = get_flat_params_from(policy.actor)
-        policy.actor.zero_grad()
+        policy.actor.zero_grad(set_to_none=True)
         # compute loss_pi
         temp_distribution = policy.actor(data["obs"])
         log_prob = temp_distribution.log_prob(data["act"]).sum(dim=-1)
         ratio = torch.exp(log_prob - data["log_prob"])
         loss_pi_r = -(ratio * data["adv_r"]).mean()
-        loss_reward_before = loss_pi_r.item()
-        old_distribution = policy.actor(data["obs"])
+        loss_reward_before = distributed_avg(loss_pi_r.detach().clone()).item()
+        old_mean = temp_distribution.mean.detach()
+        old_std = temp_distribution.stddev.detach()
 
         loss_pi_r.backward()
 
-        grads = -get_flat_gradients_from(policy.actor)
-        x = conjugate_gradients(fvp, policy, fvp_obs, grads, 15)
+        grads = distributed_avg(-get_flat_gradients_from(policy.actor))
+        # the actor stays at theta_old until the line search, so one KL
+        # gradient graph serves every Fisher-vector product of both solves
+        flat_grad_kl = kl_gradient(policy, fvp_obs)
+        x = conjugate_gradients(fvp, policy, flat_grad_kl, grads, 15)
         assert torch.isfinite(x).all(), "x is not finite"
-        xHx = torch.dot(x, fvp(x, policy, fvp_obs))
+        xHx = torch.dot(x, fvp(x, policy, flat_grad_kl))
         assert xHx.item() >= 0, "xHx is negative"
         alpha = torch.sqrt(2 * config['target_kl'] / (xHx + 1e-8))
 
-        policy.actor.zero_grad()
+        policy.actor.zero_grad(set_to_none=True)
         temp_distribution = policy.actor(data["obs"])
         log_prob = temp_distribution.log_prob(data["act"]).sum(dim=-1)
         ratio = torch.exp(log_prob - data["log_prob"])
         loss_pi_c = (ratio * data["adv_c"]).mean()
-        loss_cost_before = loss_pi_c.item()
+        loss_cost_before = distributed_avg(loss_pi_c.detach().clone()).item()
 
         loss_pi_c.backward()
 
-        b_grads = get_flat_gradients_from(policy.actor)
+        b_grads = distributed_avg(get_flat_gradients_from(policy.actor))
         ep_costs = logger.get_stats("Metrics/EpCost") - args.cost_limit
+        if is_distributed():
+            ep_costs = distributed_avg(
+                torch.as_tensor(ep_costs, dtype=torch.float32, device=device)
+            ).item()
 
-        p = conjugate_gradients(fvp, policy, fvp_obs, b_grads, 15)
+        p = conjugate_gradients(fvp, policy, flat_grad_kl, b_grads, 15)
+        del flat_grad_kl
         q = xHx
         r = grads.dot(p)
         s = b_grads.dot(p)
@@ -477,17 +547,30 @@ def main(args, cfg_env=None):
                     log_prob = temp_distribution.log_prob(data["act"]).sum(dim=-1)
                     ratio = torch.exp(log_prob - data["log_prob"])
                     loss_reward = -(ratio * data["adv_r"]).mean()
+                    candidate_ok = True
                 except ValueError:
+                    candidate_ok = False
+                # a rank whose forward failed must not leave the others waiting
+                # in the averages below, so the ranks agree on rejecting first
+                if is_distributed():
+                    ok_flag = torch.tensor(float(candidate_ok), device=device)
+                    dist.all_reduce(ok_flag, op=dist.ReduceOp.MIN)
+                    candidate_ok = bool(ok_flag.item())
+                if not candidate_ok:
                     step_frac *= 0.8
                     continue
-                temp_distribution = policy.actor(data["obs"])
-                log_prob = temp_distribution.log_prob(data["act"]).sum(dim=-1)
-                ratio = torch.exp(log_prob - data["log_prob"])
+                # the reward loss, cost loss and KL of a candidate all come
+                # from the same single actor forward
                 loss_cost = (ratio * data["adv_c"]).mean()
-                current_distribution = policy.actor(data["obs"])
-                kl = torch.distributions.kl.kl_divergence(
-                    old_distribution, current_distribution
+                kl = line_search_kl(
+                    old_mean,
+                    old_std,
+                    temp_distribution.mean,
+                    temp_distribution.stddev,
                 ).mean()
+                # every rank must take the same acceptance decision
+                for value in (loss_reward, loss_cost, kl):
+                    distributed_avg(value)
             loss_reward_improve = loss_reward_before - loss_reward.item()
             loss_cost_diff = loss_cost.item() - loss_cost_before
 
@@ -545,19 +628,18 @@ def main(args, cfg_env=None):
                 target_value_r_b,
                 target_value_c_b,
             ) in dataloader:
-                reward_critic_optimizer.zero_grad()
+                reward_critic_optimizer.zero_grad(set_to_none=True)
                 loss_r = nn.functional.mse_loss(policy.reward_critic(obs_b), target_value_r_b)
-                cost_critic_optimizer.zero_grad()
+                cost_critic_optimizer.zero_grad(set_to_none=True)
                 loss_c = nn.functional.mse_loss(policy.cost_critic(obs_b), target_value_c_b)
-                if config.get("use_critic_norm", True):
-                    for param in policy.reward_critic.parameters():
-                        loss_r += param.pow(2).sum() * 0.001
-                    for param in policy.cost_critic.parameters():
-                        loss_c += param.pow(2).sum() * 0.001
-                total_loss = 2*loss_r + loss_c \
-                    if config.get("use_value_coefficient", False) \
-                    else loss_r + loss_c
+                total_loss = reward_coef * loss_r + loss_c
                 total_loss.backward()
+                if is_distributed():
+                    for param in (
+                        *policy.reward_critic.parameters(),
+                        *policy.cost_critic.parameters(),
+                    ):
+                        distributed_avg(param.grad)
                 clip_grad_norm_(policy.parameters(), config["max_grad_norm"])
                 reward_critic_optimizer.step()
                 cost_critic_optimizer.step()
@@ -609,12 +691,16 @@ def main(args, cfg_env=None):
                         itr = epoch
                     )
     logger.close()
+    if is_distributed():
+        dist.destroy_process_group()
 
 
 if __name__ == "__main__":
     args, cfg_env = single_agent_args()
     relpath = time.strftime("%Y-%m-%d-%H-%M-%S")
     subfolder = "-".join(["seed", str(args.seed).zfill(3)])
+    if int(os.environ.get("WORLD_SIZE", 1)) > 1:
+        subfolder = "-".join([subfolder, "rank", os.environ.get("RANK", "0")])
     relpath = "-".join([subfolder, relpath])
     algo = os.path.basename(__file__).split(".")[0]
     args.log_dir = os.path.join(args.log_dir, args.experiment, args.task, algo, relpath)
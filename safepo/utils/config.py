@@ -167,6 +167,7 @@ def single_agent_args():
         {"name": "--cost-limit", "type": float, "default": 25.0, "help": "cost_lim"},
         {"name": "--lagrangian-multiplier-init", "type": float, "default": 0.001, "help": "initial value of lagrangian multiplier"},
         {"name": "--lagrangian-multiplier-lr", "type": float, "default": 0.035, "help": "learning rate of lagrangian multiplier"},
+        {"name": "--use-compile", "type": lambda x: bool(strtobool(x)), "default": False, "help": "Compile the line search KL with torch.compile"},
     ]
     # Create argument parser
     parser = argparse.ArgumentParser(description="RL Policy")
@@ -219,6 +220,7 @@ def multi_agent_args(algo):
         {"name": "--num-envs", "type": int, "default": None, "help": "The number of parallel game environments"},
         {"name": "--randomize", "type": bool, "default": False, "help": "Wheather to randomize the environments' initial states"},
         {"name": "--num-agents", "type": int, "default": 2, "help": "The number of agents"},
+        {"name": "--running-obs-norm", "type": lambda x: bool(strtobool(x)), "default": False, "help": "Normalize observations by running mean and std"},
 
     ]
     # Create argument parser
@@ -251,6 +253,7 @@ def multi_agent_args(algo):
             cfg_train.update(cfg_train.get("multi_goal"))
 
     cfg_train["use_eval"] = args.use_eval
+    cfg_train["running_obs_norm"] = args.running_obs_norm
     cfg_train["safety_bound"]=args.safety_bound
     cfg_train["algorithm_name"]=algo
     cfg_train["device"] = args.device + ":" + str(args.device_id)
@@ -23,6 +23,11 @@ def test_mappo():
         shell=True,
         check=True,
     )
+    subprocess.run(
+        "python ../safepo/multi_agent/mappo.py --total-steps 2000 --num-envs 2 --use-eval True --running-obs-norm True",
+        shell=True,
+        check=True,
+    )
 
 def test_mappolag():
     subprocess.run(
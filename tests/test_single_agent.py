@@ -1,3 +1,4 @@
+import shutil
 import subprocess
 
 def test_ppo_lag():
@@ -13,6 +14,18 @@ def test_cpo():
         shell=True,
         check=True,
     )
+    subprocess.run(
+        "torchrun --standalone --nproc_per_node 2 ../safepo/single_agent/cpo.py --total-steps 1000 --num-envs 1 --steps-per-epoch 1000 --device cpu",
+        shell=True,
+        check=True,
+    )
+    # inductor needs a host C compiler
+    if shutil.which("cc") is not None:
+        subprocess.run(
+            "python ../safepo/single_agent/cpo.py --total-steps 1000 --num-envs 1 --steps-per-epoch 1000 --use-compile True",
+            shell=True,
+            check=True,
+        )
 
 def test_cup():
     subprocess.run(